@@ -1,5 +1,6 @@
 """Download donor data from Salesforce, process and save to CSV."""
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
 import os
 import csv
@@ -7,15 +8,17 @@ import sys
 
 import numpy as np
 import pandas as pd
+import requests
 from slacker import Slacker
 from simple_salesforce import Salesforce
 from simple_salesforce.api import SalesforceRefusedRequest
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from scripts import SLACK_CHANNEL, SLACK_ACCESS_TOKEN, PROJECT_DIR, SALESFORCE_CREDENTIALS  # pylint: disable=wrong-import-position
+from scripts import SLACK_CHANNEL, SLACK_ACCESS_TOKEN, PROJECT_DIR, SALESFORCE_CREDENTIALS  # noqa pylint: disable=wrong-import-position
 
-# The Contact and Opportunity tables have no relationship in Salesforce, so there are two queries that get joined in Pandas.
+# The Contact and Opportunity tables have no relationship in Salesforce, so there are two queries that get joined in
+# Pandas.
 DONORS_OPPORTUNITIES_QUERY = """
     SELECT Amount, CloseDate, AccountId
     FROM Opportunity
@@ -39,67 +42,79 @@ def get_slack_connection(session=None):  # For tests
     return Slacker(SLACK_ACCESS_TOKEN, session=session)
 
 
+def post_slack_errors(err: SalesforceRefusedRequest, session=None):
+    """Alert the Slack channel to each error in a refused Salesforce request."""
+    slack = get_slack_connection(session=session)
+    for error in err.content:
+        message = error['message']
+        slack.chat.post_message(SLACK_CHANNEL, text=f'ERROR: {message}. @channel')
+
+
 def query_salesforce(salesforce_connection, soql_query: str) -> dict:
     """Get Salesforce data from SOQL query.
 
     Args:
         salesforce_connection (:class:`simple_salesforce.api.Salesforce`): Salesforce connection.
     """
-    try:
-        response = salesforce_connection.query_all(soql_query)
-    except SalesforceRefusedRequest as err:  # Expired password
-        slack = get_slack_connection()
-        for error in err.content:
-            message = error['message']
-            slack.chat.post_message(SLACK_CHANNEL, text=f'ERROR: {message}. @channel')
-
-        raise
-
-    return response
+    return salesforce_connection.query_all(soql_query)
 
 
 def create_opportunities_dataframe(response: dict) -> pd.DataFrame:
     """Convert Salesforce query response to a dataframe with each Opportunity's amount, data, and Account ID."""
-    data = [{'AMT': r['Amount'], 'DATE': r['CloseDate'], 'ACCOUNT': r['AccountId']} for r in response['records']]
-    return pd.DataFrame(data)
+    dataframe = pd.DataFrame.from_records(response['records'], columns=['Amount', 'CloseDate', 'AccountId'])
+    dataframe.rename(columns={'Amount': 'AMT', 'CloseDate': 'DATE', 'AccountId': 'ACCOUNT'}, inplace=True)
+    return dataframe
 
 
 def create_contacts_dataframe(response: dict) -> pd.DataFrame:
     """Convert Salesforce query response to a dataframe with each contact's name and Account ID."""
-    data = [{'ACCOUNT': record['AccountId'], 'NAME': record['Name']} for record in response['records']]
-    return pd.DataFrame(data)
+    dataframe = pd.DataFrame.from_records(response['records'], columns=['AccountId', 'Name'])
+    dataframe.rename(columns={'AccountId': 'ACCOUNT', 'Name': 'NAME'}, inplace=True)
+    return dataframe
 
 
-def clean_opportunities_dataframe(dataframe: pd.DataFrame) -> pd.DataFrame:
-    """Clean the raw Opportunities DataFrame into a cleaned dataframe.
+def encode_accounts(opportunities_dataframe: pd.DataFrame, contacts_dataframe: pd.DataFrame):
+    """Replace the Account IDs in both DataFrames with shared integer codes, in Account ID order.
 
-    Fix data types and create the "YEAR" column.
+    Args:
+        opportunities_dataframe (:class:`DataFrame`): Raw Opportunities (donations).
+        contacts_dataframe (:class:`DataFrame`): Raw Contacts.
+
+    Returns:
+        tuple: The Opportunities and the Contacts on Accounts with Opportunities, with ACCOUNT as integer codes.
     """
-    dataframe['AMT'] = pd.to_numeric(dataframe['AMT'], errors='coerce')
-    dataframe['AMT'] = dataframe['AMT'].astype(int)
-    dataframe['DATE'] = pd.to_datetime(dataframe['DATE'], format='%Y-%m-%d')
-    dataframe['YEAR'] = [d.year for d in dataframe['DATE']]
-    del dataframe['DATE']
-    return dataframe
+    split = len(opportunities_dataframe)
+    codes, _ = pd.factorize(np.concatenate([opportunities_dataframe['ACCOUNT'].values,
+                                            contacts_dataframe['ACCOUNT'].values]), sort=True)
 
+    opportunities_dataframe['ACCOUNT'] = codes[:split]
+    contacts_dataframe['ACCOUNT'] = codes[split:]
 
-def build_series_no_serial_comma(names: list) -> str:
-    """Build an AP style series (no serial comma) string from a list of values."""
-    all_but_final_and_final = []
+    donors = contacts_dataframe['ACCOUNT'].isin(opportunities_dataframe['ACCOUNT'])
+    return opportunities_dataframe, contacts_dataframe[donors]
 
-    if len(names) > 2:  # ['X', 'Y', 'Z']
-        all_but_final_name = ', '.join(names[:-1])  # 'X, Y'
-        all_but_final_and_final = [all_but_final_name, names[-1]]  # ['X, Y', 'Z']
-    else:  # ['X', 'Y']
-        all_but_final_and_final = names
 
-    return ' and '.join(all_but_final_and_final)
+def clean_opportunities_dataframe(dataframe: pd.DataFrame) -> pd.DataFrame:
+    """Clean the raw Opportunities DataFrame into a cleaned dataframe.
+
+    Fix data types and create the "YEAR" column.
+    """
+    dataframe['AMT'] = pd.to_numeric(dataframe['AMT'], errors='coerce').astype('int32')
+    # Donations share relatively few close dates, so parse each distinct date once and map the years back.
+    date_codes, unique_dates = pd.factorize(dataframe['DATE'])
+    unique_years = np.asarray(pd.to_datetime(unique_dates, format='%Y-%m-%d', exact=True).year, dtype=np.int16)
+    # factorize codes a missing date as -1, which would index the last year, so drop those donations instead.
+    dated = date_codes != -1
+    dataframe = dataframe[dated].drop('DATE', axis=1)
+    dataframe['YEAR'] = unique_years[date_codes[dated]]
+    return dataframe
 
 
 def clean_contacts_dataframe(dataframe: pd.DataFrame):
     """Clean the Contacts (donors) DataFrame.
 
-    Combine contacts with the same Account into a single record.
+    Combine contacts with the same Account into a single record, joining their names as an AP style series (no
+    serial comma).
 
     Args:
         dataframe (:class:`DataFrame`): The raw Contacts (donors) DataFrame.
@@ -107,7 +122,14 @@ def clean_contacts_dataframe(dataframe: pd.DataFrame):
     Returns:
         :class:`DataFrame`: Contacts (donors) grouped by Accounts.
     """
-    return dataframe.groupby(['ACCOUNT'])['NAME'].apply(lambda x: build_series_no_serial_comma(x.tolist())).reset_index()
+    # Suffix each name with the separator that follows it in its Account's series: 'X, Y and Z'.
+    names_left = dataframe.groupby('ACCOUNT', sort=False).cumcount(ascending=False).values
+    separators = np.full(len(names_left), ', ', dtype=object)
+    separators[names_left == 1] = ' and '
+    separators[names_left == 0] = ''
+
+    names = dataframe['NAME'] + separators
+    return names.groupby(dataframe['ACCOUNT'], sort=False).agg(''.join).reset_index()
 
 
 def merge_and_slice(opportunities_dataframe, contacts_dataframe):
@@ -120,8 +142,9 @@ def merge_and_slice(opportunities_dataframe, contacts_dataframe):
     Returns:
         :class:`DataFrame`: The Opportunities matched with their donors.
     """
-    merged_dataframe = pd.merge(opportunities_dataframe, contacts_dataframe, on='ACCOUNT')
-    return merged_dataframe.loc[merged_dataframe['YEAR'] <= date.today().year]
+    merged_dataframe = opportunities_dataframe.join(contacts_dataframe.set_index('ACCOUNT'), on='ACCOUNT', how='inner')
+    current_year = date.today().year
+    return merged_dataframe[merged_dataframe['YEAR'].values <= current_year]
 
 
 def bin_donors_by_giving_level(dataframe: pd.DataFrame):
@@ -135,7 +158,8 @@ def bin_donors_by_giving_level(dataframe: pd.DataFrame):
             labels, sorted first by giving level (descending) and second by
             last name (ascending).
     """
-    bins = [0, 50, 100, 250, 500, 1000, 2500, np.inf]
+    # Lower bounds of every level after the first
+    bins = [50, 100, 250, 500, 1000, 2500]
 
     labels = [
         "<strong>Friend\n$1-$49</strong>",
@@ -147,9 +171,10 @@ def bin_donors_by_giving_level(dataframe: pd.DataFrame):
         "<strong>Publisher's Circle\n$2,500-$4,999</strong>"
     ]
 
-    # right=False is exclusive of upper bound
-    dataframe['LEVEL'] = pd.cut(dataframe['AMT'], bins, right=False, labels=labels)
-    dataframe['LASTNAME'] = dataframe['NAME'].apply(lambda x: x.split(' ')[-1])
+    # side='right' puts an amount equal to a lower bound into that level
+    level_codes = np.searchsorted(bins, dataframe['AMT'].values, side='right')
+    dataframe['LEVEL'] = pd.Categorical.from_codes(level_codes, categories=labels, ordered=True)
+    dataframe['LASTNAME'] = dataframe['NAME'].str.extract(r'(\S+)\s*$', expand=False)
 
     # LEVEL is asc=False because categorical.
     dataframe.sort_values(['LEVEL', 'LASTNAME'], ascending=[False, True], inplace=True)
@@ -166,26 +191,46 @@ def write_levels_csv(dataframe: pd.DataFrame, file_name: str):
     if not os.path.exists(os.path.dirname(csv_out)):
         os.makedirs(os.path.dirname(csv_out))
 
-    with open(csv_out, 'w') as out_file:
+    with open(csv_out, 'w', buffering=1024 * 1024, newline='') as out_file:  # 1 MiB buffer
         csvwriter = csv.writer(out_file, quoting=csv.QUOTE_ALL)
 
-        current_level = ''
-        for donor in dataframe[['NAME', 'LEVEL']].itertuples():
-            if current_level != donor.LEVEL:
-                current_level = donor.LEVEL
-                csvwriter.writerow([donor.LEVEL])
+        # Donors are sorted by level, so each level's header row goes right before the first donor at that level.
+        level_starts = np.unique(pd.factorize(dataframe['LEVEL'])[0], return_index=True)[1]
+        rows = np.insert(dataframe['NAME'].values.astype(object), level_starts, dataframe['LEVEL'].values[level_starts])
+        csvwriter.writerows(zip(rows))
 
-            csvwriter.writerow([donor.NAME])
+
+def sum_donations(dataframe: pd.DataFrame, keys: list) -> pd.DataFrame:
+    """Sum donation amounts for each unique combination of ``keys``, keeping other columns from each group's first row.
+
+    Args:
+        dataframe (:class:`DataFrame`): Donations.
+        keys (list): Columns to group by.
+
+    Returns:
+        :class:`DataFrame`: One row per group, sorted by ``keys``, with AMT summed.
+    """
+    codes = np.zeros(len(dataframe), dtype=np.int64)
+    for key in keys:
+        key_codes, key_uniques = pd.factorize(dataframe[key], sort=True)
+        codes, _ = pd.factorize(codes * len(key_uniques) + key_codes, sort=True)
+
+    _, first_rows = np.unique(codes, return_index=True)
+    sums = np.bincount(codes, weights=dataframe['AMT'].values, minlength=len(first_rows))
+
+    summed = dataframe.iloc[first_rows].reset_index(drop=True)
+    summed['AMT'] = sums.astype(dataframe['AMT'].dtype)
+    return summed
 
 
 def get_donations_by_year(dataframe: pd.DataFrame) -> pd.DataFrame:
     """Sum all donations by year and donor."""
-    return dataframe.groupby(['YEAR', 'ACCOUNT', 'NAME'])['AMT'].sum().reset_index()
+    return sum_donations(dataframe, ['YEAR', 'ACCOUNT'])
 
 
 def get_donations_by_donor(dataframe: pd.DataFrame) -> pd.DataFrame:
     """Sum all donations by donor (across all years)."""
-    sum_by_person = dataframe.groupby(['ACCOUNT', 'NAME'])['AMT'].sum().reset_index()
+    sum_by_person = sum_donations(dataframe, ['ACCOUNT'])
     sum_by_person['YEAR'] = 'all-time'
     return sum_by_person
 
@@ -200,14 +245,36 @@ def get_salesforce_connection(session=None):
     )
 
 
+def summarize_and_bin(dataframe: pd.DataFrame) -> pd.DataFrame:
+    """Sum each donor's donations by year and sort them into giving levels.
+
+    Every year is summed, binned and sorted together, so the per-year CSV files are only slices of the result.
+
+    Args:
+        dataframe (:class:`DataFrame`): All donations.
+
+    Returns:
+        :class:`DataFrame`: Annual donations for each donor with their giving levels.
+    """
+    return bin_donors_by_giving_level(get_donations_by_year(dataframe))
+
+
 def process_annual_donations(dataframe: pd.DataFrame):
-    """Sort each donor's annual donations into giving levels.
+    """Write out each year's donors and giving levels to a CSV file.
 
-    Write out each year's data to a CSV file.
+    Args:
+        dataframe (:class:`DataFrame`): Binned annual donations, from :func:`summarize_and_bin`.
     """
-    for year in range(dataframe['YEAR'].min(), dataframe['YEAR'].max() + 1):
-        levels_dataframe = bin_donors_by_giving_level(dataframe)
-        write_levels_csv(levels_dataframe[levels_dataframe['YEAR'] == year], str(year))
+    # A stable sort keeps each year's donors in level order and makes every year a contiguous slice.
+    dataframe = dataframe.sort_values('YEAR', kind='mergesort')
+    sorted_years = dataframe['YEAR'].values
+
+    years = np.arange(sorted_years.min(), sorted_years.max() + 1)
+    starts = np.searchsorted(sorted_years, years, side='left')
+    ends = np.searchsorted(sorted_years, years, side='right')
+
+    for year, start, end in zip(years, starts, ends):
+        write_levels_csv(dataframe.iloc[start:end], str(year))
 
 
 def get_donations() -> pd.DataFrame:
@@ -216,13 +283,30 @@ def get_donations() -> pd.DataFrame:
     Returns:
         :class:`DataFrame`: All donations.
     """
-    salesforce_connection = get_salesforce_connection()
-
-    opportunities = query_salesforce(salesforce_connection, DONORS_OPPORTUNITIES_QUERY)
-    contacts = query_salesforce(salesforce_connection, DONORS_CONTACTS_QUERY)
+    # Log in once, then run the two independent queries concurrently. requests does not promise that a Session is
+    # thread-safe, so the Contacts query reuses the login from its own session.
+    with requests.Session() as session, requests.Session() as contacts_session, \
+            ThreadPoolExecutor(max_workers=2) as executor:
+        salesforce_connection = get_salesforce_connection(session=session)
+        contacts_connection = Salesforce(instance=salesforce_connection.sf_instance,
+                                         session_id=salesforce_connection.session_id,
+                                         version=salesforce_connection.sf_version,
+                                         session=contacts_session)
+
+        opportunities_future = executor.submit(query_salesforce, salesforce_connection, DONORS_OPPORTUNITIES_QUERY)
+        contacts_future = executor.submit(query_salesforce, contacts_connection, DONORS_CONTACTS_QUERY)
+
+        try:
+            opportunities = opportunities_future.result()
+            contacts = contacts_future.result()
+        except SalesforceRefusedRequest as err:  # Expired password
+            # Both queries fail the same way, so alert the channel once.
+            post_slack_errors(err, session=session)
+            raise
 
     opportunities_dataframe = create_opportunities_dataframe(opportunities)
     contacts_dataframe = create_contacts_dataframe(contacts)
+    opportunities_dataframe, contacts_dataframe = encode_accounts(opportunities_dataframe, contacts_dataframe)
 
     cleaned_opportunities_dataframe = clean_opportunities_dataframe(opportunities_dataframe)
     cleaned_contacts_dataframe = clean_contacts_dataframe(contacts_dataframe)
@@ -243,8 +327,8 @@ def main():
     write_levels_csv(giving_levels_dataframe, 'all-time-donations')
 
     # Process annual donations
-    annual_donations_dataframe = get_donations_by_year(donations_dataframe)
-    process_annual_donations(annual_donations_dataframe)
+    annual_levels_dataframe = summarize_and_bin(donations_dataframe)
+    process_annual_donations(annual_levels_dataframe)
 
 
 if __name__ == "__main__":
@@ -1,12 +1,14 @@
 """Unit tests for scripts/initialize.py."""
 
+import csv
 import os
 import pandas as pd
 import requests
 import sys
+import tempfile
 import unittest
 
-from mock import patch, call
+from mock import patch
 from simple_salesforce.api import SalesforceRefusedRequest
 
 sys.path.insert(
@@ -14,7 +16,7 @@ sys.path.insert(
 sys.path.insert(
     0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../scripts')))
 
-from scripts import main
+from scripts import main  # noqa
 
 
 class TestMain(unittest.TestCase):
@@ -41,7 +43,32 @@ class TestMain(unittest.TestCase):
         with self.assertRaises(SalesforceRefusedRequest):
             main.query_salesforce(mock_sf, query)
 
-        assert mock_slack.called
+        # get_donations() sends the alert, once for both queries.
+        assert not mock_slack.called
+
+    @patch('scripts.main.Slacker')
+    @patch('scripts.main.Salesforce')
+    @patch('scripts.main.get_salesforce_connection')
+    def test_get_donations_expired_password(self, mock_connection, mock_sf,
+                                            mock_slack):
+        """Test get_donations() alerts Slack once when both queries fail."""
+        error = SalesforceRefusedRequest(
+            'url', 'status', 'resource_name', [{'message': 'Error'}])
+        mock_connection.return_value.query_all.side_effect = error
+        mock_sf.return_value.query_all.side_effect = error
+
+        with self.assertRaises(SalesforceRefusedRequest):
+            main.get_donations()
+
+        mock_slack.return_value.chat.post_message.assert_called_once_with(
+            main.SLACK_CHANNEL, text='ERROR: Error. @channel')
+
+        # The Contacts query runs on its own session, reusing the login.
+        connection = mock_connection.return_value
+        _, kwargs = mock_sf.call_args
+        self.assertEqual(kwargs['session_id'], connection.session_id)
+        self.assertEqual(kwargs['instance'], connection.sf_instance)
+        self.assertIsNot(kwargs['session'], mock_connection.call_args[1]['session'])
 
     def test_create_opportunities_dataframe(self):
         """Test create_opportunities_dataframe()."""
@@ -52,7 +79,8 @@ class TestMain(unittest.TestCase):
         actual = main.create_opportunities_dataframe(response)
         expected = pd.DataFrame.from_dict([
             {'AMT': '10', 'DATE': '2016', 'ACCOUNT': '1'},
-            {'AMT': '20', 'DATE': '2015', 'ACCOUNT': '2'}])
+            {'AMT': '20', 'DATE': '2015', 'ACCOUNT': '2'}]
+        )[['AMT', 'DATE', 'ACCOUNT']]
 
         self.assertTrue(actual.equals(expected))
 
@@ -64,29 +92,57 @@ class TestMain(unittest.TestCase):
 
         actual = main.create_contacts_dataframe(response)
         expected = pd.DataFrame.from_dict([{'NAME': 'John', 'ACCOUNT': '1'},
-                                           {'NAME': 'Jane', 'ACCOUNT': '2'}])
+                                           {'NAME': 'Jane', 'ACCOUNT': '2'}]
+                                          )[['ACCOUNT', 'NAME']]
 
         self.assertTrue(actual.equals(expected))
 
-    @patch('scripts.main.build_series_no_serial_comma')
-    def test_clean_opportunities_dataframe(self, mock_build_series):
+    def test_encode_accounts(self):
+        """Test encode_accounts()."""
+        opps_dataframe = pd.DataFrame.from_dict([
+            {'ACCOUNT': 'b', 'AMT': 10},
+            {'ACCOUNT': 'a', 'AMT': 20},
+            {'ACCOUNT': 'b', 'AMT': 30}])
+        contacts_dataframe = pd.DataFrame.from_dict([
+            {'ACCOUNT': 'b', 'NAME': 'John'},
+            {'ACCOUNT': 'c', 'NAME': 'Jane'},
+            {'ACCOUNT': None, 'NAME': 'Jim'}])
+
+        opps, contacts = main.encode_accounts(opps_dataframe, contacts_dataframe)
+
+        # Codes follow Account ID order, not order of appearance.
+        self.assertEqual(opps['ACCOUNT'].tolist(), [1, 0, 1])
+        self.assertEqual(contacts['ACCOUNT'].tolist(), [1])
+        self.assertEqual(contacts['NAME'].tolist(), ['John'])
+
+    def test_clean_opportunities_dataframe(self):
         """Test clean_opportunities_dataframe()."""
         d = [{'AMT': '1', 'DATE': '2016-10-31', 'ACCOUNT': '1'},
              {'AMT': 2, 'DATE': '2015-12-25', 'ACCOUNT': '2'}]
         df = pd.DataFrame.from_dict(d)
 
-        actual = main.clean_opportunities_dataframe(df)
+        actual = main.clean_opportunities_dataframe(df).sort_index(axis=1)
         expected = pd.DataFrame.from_dict([
             {'AMT': 1, 'YEAR': 2016, 'ACCOUNT': '1'},
-            {'AMT': 2, 'YEAR': 2015, 'ACCOUNT': '2'}])
+            {'AMT': 2, 'YEAR': 2015, 'ACCOUNT': '2'}]
+        ).astype({'AMT': 'int32', 'YEAR': 'int16'}).sort_index(axis=1)
 
         self.assertTrue(actual.equals(expected))
 
-    @patch('scripts.main.build_series_no_serial_comma')
-    def test_clean_contacts_dataframe(self, mock_build_series):
-        """Test clean_contacts_dataframe()."""
-        mock_build_series.return_value = 'John, Jane and Jim'
+    def test_clean_opportunities_dataframe_missing_date(self):
+        """Test clean_opportunities_dataframe() drops a missing date."""
+        df = pd.DataFrame.from_dict([
+            {'AMT': 1, 'DATE': '2015-01-01', 'ACCOUNT': '1'},
+            {'AMT': 2, 'DATE': None, 'ACCOUNT': '2'},
+            {'AMT': 3, 'DATE': '2016-01-01', 'ACCOUNT': '3'}])
 
+        actual = main.clean_opportunities_dataframe(df)
+
+        self.assertEqual(actual['ACCOUNT'].tolist(), ['1', '3'])
+        self.assertEqual(actual['YEAR'].tolist(), [2015, 2016])
+
+    def test_clean_contacts_dataframe(self):
+        """Test clean_contacts_dataframe()."""
         d = [{'ACCOUNT': '1', 'NAME': 'John'},
              {'ACCOUNT': '1', 'NAME': 'Jane'},
              {'ACCOUNT': '1', 'NAME': 'Jim'}]
@@ -98,25 +154,24 @@ class TestMain(unittest.TestCase):
 
         self.assertTrue(actual.equals(expected))
 
-    def test_build_series_no_serial_comma_empty(self):
-        """Test build_series_no_serial_comma() with empty list."""
-        name_series = main.build_series_no_serial_comma([])
-        self.assertEqual(name_series, "")
-
-    def test_build_series_no_serial_comma_single_name(self):
-        """Test build_series_no_serial_comma() with a single name."""
-        name_series = main.build_series_no_serial_comma(["John"])
-        self.assertEqual(name_series, "John")
+    def test_clean_contacts_dataframe_series(self):
+        """Test clean_contacts_dataframe() with one, two and four names."""
+        d = [{'ACCOUNT': '1', 'NAME': 'John'},
+             {'ACCOUNT': '2', 'NAME': 'Jane'},
+             {'ACCOUNT': '3', 'NAME': 'Jim'},
+             {'ACCOUNT': '2', 'NAME': 'Jan'},
+             {'ACCOUNT': '3', 'NAME': 'Joe'},
+             {'ACCOUNT': '3', 'NAME': 'John Doe, Jr.'},
+             {'ACCOUNT': '3', 'NAME': 'Jon'}]
+        df = pd.DataFrame.from_dict(d)
 
-    def test_build_series_no_serial_comma_two_names(self):
-        """Test build_series_no_serial_comma() with two names."""
-        name_series = main.build_series_no_serial_comma(["John", "Jane"])
-        self.assertEqual(name_series, "John and Jane")
+        actual = main.clean_contacts_dataframe(df)
 
-    def test_build_series_no_serial_comma_three_names(self):
-        """Test build_series_no_serial_comma() with three names."""
-        series = main.build_series_no_serial_comma(["John", "Jane", "Jim"])
-        self.assertEqual(series, "John, Jane and Jim")
+        self.assertEqual(actual['ACCOUNT'].tolist(), ['1', '2', '3'])
+        self.assertEqual(actual['NAME'].tolist(), [
+            'John',
+            'Jane and Jan',
+            'Jim, Joe, John Doe, Jr. and Jon'])
 
     def test_merge_and_slice(self):
         """Test merge_and_slice()."""
@@ -169,25 +224,46 @@ class TestMain(unittest.TestCase):
 
         self.assertTrue(actual.equals(expected))
 
-    @patch('scripts.main.csv.writer')
-    def test_write_levels_csv(self, mock_csv):
+    def test_write_levels_csv(self):
         """Test write_levels_csv()."""
         df = pd.DataFrame.from_dict([
             {'NAME': 'John Doe', 'LEVEL': "Publisher's Circle"},
             {'NAME': 'Jane Doe', 'LEVEL': "Publisher's Circle"},
             {'NAME': 'John Deere', 'LEVEL': "Editor's Circle"}])
 
-        main.write_levels_csv(df, '2016')
+        with tempfile.TemporaryDirectory() as project_dir:
+            with patch('scripts.main.PROJECT_DIR', project_dir):
+                main.write_levels_csv(df, '2016')
+
+            with open('{}/data/2016.csv'.format(project_dir)) as csv_file:
+                rows = list(csv.reader(csv_file))
 
-        mock_csv_calls = [
-            call(["Publisher's Circle"]),
-            call(["John Doe"]),
-            call(["Jane Doe"]),
-            call(["Editor's Circle"]),
-            call(["John Deere"])]
+        expected_rows = [
+            ["Publisher's Circle"],
+            ["John Doe"],
+            ["Jane Doe"],
+            ["Editor's Circle"],
+            ["John Deere"]]
 
+        self.assertEqual(rows, expected_rows)
+
+    def test_sum_donations(self):
+        """Test sum_donations()."""
+        df = pd.DataFrame.from_dict([
+            {'YEAR': 2016, 'ACCOUNT': 2, 'AMT': 5, 'NAME': 'Jane Doe'},
+            {'YEAR': 2015, 'ACCOUNT': 1, 'AMT': 10, 'NAME': 'John Doe'},
+            {'YEAR': 2016, 'ACCOUNT': 1, 'AMT': 20, 'NAME': 'John Doe'},
+            {'YEAR': 2016, 'ACCOUNT': 2, 'AMT': 30, 'NAME': 'Jane Doe'}]
+        ).astype({'AMT': 'int32'})
+
+        returned = main.sum_donations(df, ['YEAR', 'ACCOUNT'])
+
+        self.assertEqual(returned['YEAR'].tolist(), [2015, 2016, 2016])
+        self.assertEqual(returned['ACCOUNT'].tolist(), [1, 1, 2])
+        self.assertEqual(returned['AMT'].tolist(), [10, 20, 35])
         self.assertEqual(
-            mock_csv.return_value.writerow.call_args_list, mock_csv_calls)
+            returned['NAME'].tolist(), ['John Doe', 'John Doe', 'Jane Doe'])
+        self.assertEqual(returned['AMT'].dtype, 'int32')
 
     def test_get_donations_by_year(self):
         """Test get_donations_by_year()."""
@@ -243,26 +319,45 @@ class TestMain(unittest.TestCase):
 
         session.close()
 
-    @patch('scripts.main.write_levels_csv')
     @patch('scripts.main.bin_donors_by_giving_level')
-    def test_process_annual_donations(self, mock_bin, mock_csv):
-        """Test process_annual_donations()."""
-        df = pd.DataFrame.from_dict([{'YEAR': 2015},
-                                     {'YEAR': 2016},
-                                     {'YEAR': 2017}])
+    @patch('scripts.main.get_donations_by_year')
+    def test_summarize_and_bin(self, mock_by_year, mock_bin):
+        """Test summarize_and_bin()."""
+        df = pd.DataFrame.from_dict([{'YEAR': 2015}])
+
+        returned = main.summarize_and_bin(df)
+
+        mock_by_year.assert_called_once_with(df)
+        mock_bin.assert_called_once_with(mock_by_year.return_value)
+        self.assertEqual(returned, mock_bin.return_value)
+
+    def test_summarize_and_bin_ties(self):
+        """Test summarize_and_bin() keeps tied donors in Account order."""
+        df = pd.DataFrame.from_dict([
+            {'YEAR': 2016, 'ACCOUNT': 2, 'AMT': 60, 'NAME': 'Jane Doe'},
+            {'YEAR': 2016, 'ACCOUNT': 1, 'AMT': 70, 'NAME': 'John Doe'},
+            {'YEAR': 2016, 'ACCOUNT': 3, 'AMT': 80, 'NAME': 'Jim Deere'}])
 
-        mock_bin.return_value = df
+        returned = main.summarize_and_bin(df)
+
+        self.assertEqual(returned['NAME'].tolist(),
+                         ['Jim Deere', 'John Doe', 'Jane Doe'])
+
+    @patch('scripts.main.write_levels_csv')
+    def test_process_annual_donations(self, mock_csv):
+        """Test process_annual_donations()."""
+        df = pd.DataFrame.from_dict([{'YEAR': 2017, 'NAME': 'John Doe'},
+                                     {'YEAR': 2015, 'NAME': 'Jane Doe'},
+                                     {'YEAR': 2017, 'NAME': 'Jim Doe'}])
 
         main.process_annual_donations(df)
 
-        mock_csv_calls = [
-            call(df[df['YEAR'] == 2015], '2015'),
-            call(df[df['YEAR'] == 2016], '2016'),
-            call(df[df['YEAR'] == 2017], '2017')]
+        file_names = [args[1] for args, _ in mock_csv.call_args_list]
+        names = [args[0]['NAME'].tolist()
+                 for args, _ in mock_csv.call_args_list]
 
-        # Need to use Pandas' `.equals()` to test for equality instead of same.
-        for i, mock_csv_call in enumerate(mock_csv_calls):
-            self.assertTrue(mock_csv.call_args_list[i].equals(mock_csv_call))
+        self.assertEqual(file_names, ['2015', '2016', '2017'])
+        self.assertEqual(names, [['Jane Doe'], [], ['John Doe', 'Jim Doe']])
 
 if __name__ == '__main__':
     unittest.main()
@@ -4,24 +4,26 @@
 
 import os
 import pep8
-import fnmatch
 
 import unittest
 
+from functools import lru_cache
+
 from scripts import PROJECT_DIR
 
-python_dirs = [
-    '{}/scripts/'.format(PROJECT_DIR),
-    '{}/tests/'.format(PROJECT_DIR)]
+project_realpath = os.path.realpath(PROJECT_DIR)
+
+# Each ends in a separator so that only the Python directories themselves and
+# their subdirectories match.
+python_prefixes = tuple(
+    os.path.join(project_realpath, python_dir, '')
+    for python_dir in ('scripts', 'tests'))
 
 
+@lru_cache(maxsize=None)
 def should_check_directory(directory):
     """Check if this directory should be checked."""
-    for python_dir in python_dirs:
-        if python_dir in directory:
-            return True
-
-    return False
+    return (directory + os.sep).startswith(python_prefixes)
 
 
 class TestPep8(unittest.TestCase):
@@ -29,16 +31,17 @@ class TestPep8(unittest.TestCase):
 
     def test_pep8(self):
         """Test that all Python files conform to PEP8 standards."""
-        pep8style = pep8.StyleGuide(quiet=True)
+        pep8style = pep8.StyleGuide(quiet=True, max_line_length=120)
 
         # Find all .py files
         files_list = []
-        for root, dirnames, filenames in os.walk(PROJECT_DIR):
+        for root, dirnames, filenames in os.walk(project_realpath):
             if not should_check_directory(root):
                 continue
 
-            for filename in fnmatch.filter(filenames, '*.py'):
-                files_list.append(os.path.join(root, filename))
+            prefix = root + os.sep
+            files_list.extend(prefix + filename for filename in filenames
+                              if filename.endswith('.py'))
 
         errors = pep8style.check_files(files_list).total_errors
 
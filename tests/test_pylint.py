@@ -2,43 +2,143 @@
 
 """Test that all Python files in project pass pylint tests."""
 
+import json
 import os
-import fnmatch
+import unittest
 
-from subprocess import call
+from pathlib import Path
+from subprocess import CalledProcessError, check_call, check_output
 
 from scripts import PROJECT_DIR
 
-python_dirs = [
-    '{}/scripts/'.format(PROJECT_DIR),
-    '{}/tests/'.format(PROJECT_DIR)]
+try:
+    from pylint.lint import Run
+except ImportError:
+    Run = None
 
+python_dirs = tuple(
+    os.path.join(PROJECT_DIR, python_dir) for python_dir in ('scripts', 'tests'))
 
-def should_check_directory(directory):
-    """Check if this directory should be checked."""
+files_cache = os.path.join(PROJECT_DIR, 'tests', '.cache', 'pylint_files.json')
+
+# Directories that never hold files to lint, and whose contents change on
+# every run.
+ignored_dirs = ('__pycache__', '.cache')
+
+pylintrc = os.path.join(PROJECT_DIR, '.pylintrc')
+
+
+def iter_python_files():
+    """Yield the path of each Python file in the Python directories."""
+    # Only walk the Python directories, not the whole project tree.
+    for python_dir in python_dirs:
+        for path in Path(python_dir).rglob('*.py'):
+            yield str(path)
+
+
+def directory_signature():
+    """Return the modification time of every directory under the Python
+    directories, keyed by path.
+
+    A directory's modification time changes whenever a file is added to,
+    removed from or renamed in it, so this changes whenever the set of
+    Python files does, at any depth.
+    """
+    signature = {}
     for python_dir in python_dirs:
-        if python_dir in directory:
-            return True
+        for dir_path, dir_names, _ in os.walk(python_dir):
+            dir_names[:] = [name for name in dir_names
+                            if name not in ignored_dirs]
+            signature[dir_path] = os.stat(dir_path).st_mtime_ns
+
+    return signature
+
+
+def cached_python_files():
+    """Return the Python files, reusing the last run's list if possible.
+
+    The list is keyed by :func:`directory_signature`. Walking the directories
+    for it is still cheaper than globbing every file, and the cache directory
+    is created first so that creating it does not invalidate the list.
+    """
+    os.makedirs(os.path.dirname(files_cache), exist_ok=True)
+    signature = directory_signature()
 
-    return False
+    try:
+        with open(files_cache) as cache_file:
+            cache = json.load(cache_file)
 
+        if cache['signature'] == signature:
+            return cache['files']
+    except (OSError, ValueError, KeyError):
+        pass
 
-class RunPylint(object):
+    files_list = list(iter_python_files())
+
+    with open(files_cache, 'w') as cache_file:
+        json.dump({'signature': signature, 'files': files_list}, cache_file)
+
+    return files_list
+
+
+def changed_files():
+    """Return the files that differ from the last commit, including new ones.
+
+    Returns an empty set when git is unavailable.
+    """
+    commands = [
+        ['git', 'diff', '--name-only', '--relative', 'HEAD'],
+        ['git', 'ls-files', '--others', '--exclude-standard']]
+
+    try:
+        output = b''.join(check_output(command, cwd=PROJECT_DIR)
+                          for command in commands)
+    except (OSError, CalledProcessError):
+        return set()
+
+    return {os.path.join(PROJECT_DIR, name)
+            for name in output.decode().splitlines()}
+
+
+class RunPylint(unittest.TestCase):
     """Run pylint on all Python files."""
 
+    @unittest.skipUnless(os.getenv('RUN_PYLINT'),
+                         'Set RUN_PYLINT=1 to run pylint.')
     def test_pylint(self):
         """Run pylint on all Python files."""
-        files_list = []
+        files_list = cached_python_files()
+
+        # Only lint what changed since the last commit, or everything on a
+        # clean tree.
+        changed = changed_files()
+        files_list = [path for path in files_list
+                      if path in changed] or files_list
+
+        if not files_list:
+            return
 
-        for root, dirnames, filenames in os.walk(PROJECT_DIR):
-            if not should_check_directory(root):
-                continue
+        # Parallel jobs only pay off once there are enough files to outweigh
+        # starting the worker processes. Leave two cores free for the host
+        # rather than using every core as .pylintrc's jobs=0 does.
+        if len(files_list) > 4:
+            jobs = max(1, (os.cpu_count() or 1) - 2)
+        else:
+            jobs = 1
 
-            for filename in fnmatch.filter(filenames, '*.py'):
-                files_list.append(os.path.join(root, filename))
+        args = ['--rcfile={}'.format(pylintrc), '--jobs={}'.format(jobs)]
+        args += files_list
 
-        for file in files_list:
-            call(['pylint', '--errors-only', file])
+        # Lint in this interpreter when possible so pylint and astroid are
+        # only imported once.
+        if Run is not None:
+            status = Run(args, exit=False).linter.msg_status
+            self.assertEqual(status, 0, 'pylint found errors.')
+        else:
+            try:
+                check_call(['pylint'] + args)
+            except CalledProcessError as err:
+                self.fail(str(err))
 
 if __name__ == '__main__':
-    RunPylint().test_pylint()
+    unittest.main()